@@ -329,9 +329,9 @@ export default function AudioAnalysis({ audioData }: AudioAnalysisProps) {
         </CardHeader>
         <CardContent>
           <div className="h-64 bg-gray-100 rounded-lg flex items-end justify-center p-4">
-            <div className="flex items-end space-x-1 h-full w-full max-w-2xl">
+            <div className="flex items-end space-x-px h-full w-full max-w-2xl">
               {results?.frequencySpectrum && results.frequencySpectrum.length > 0 ? (
-                results.frequencySpectrum.slice(0, 50).map((point: any, index: number) => (
+                results.frequencySpectrum.map((point: any, index: number) => (
                   <div
                     key={index}
                     className="bg-purple-500 rounded-t"
@@ -351,7 +351,8 @@ export default function AudioAnalysis({ audioData }: AudioAnalysisProps) {
             </div>
           </div>
           <p className="text-sm text-gray-600 mt-2 text-center">
-            Frequency range: 0 - {results?.frequencySpectrum?.[results.frequencySpectrum.length - 1]?.frequency || 0} Hz
+            Frequency range: {results?.frequencySpectrum?.[0]?.frequency || 0} -{" "}
+            {results?.frequencySpectrum?.[results.frequencySpectrum.length - 1]?.frequency || 0} Hz (log scale)
           </p>
         </CardContent>
       </Card>
@@ -7,7 +7,11 @@ import librosa.display
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.signal import find_peaks
+import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import rfft, rfftfreq
+from scipy.signal import find_peaks, welch
+from scipy.signal.windows import hann
 import json
 import sys
 import base64
@@ -15,11 +19,107 @@ import io
 from scipy.io import wavfile
 import tempfile
 import os
+import glob
+import audio_common
+from audio_common import (
+    to_json, compute_frame_energy, normalize_energy, sample_spectrum, fast_stft,
+    load_audio_bytes, batch_analyze, serve
+)
+
+# Longer files are analyzed block by block to keep memory bounded
+STREAMING_MIN_DURATION = 300  # seconds
 
 # Set matplotlib to use Agg backend for server environments
 matplotlib.use('Agg')
 
-def analyze_audio(audio_data_base64, filename="uploaded_audio"):
+def spectral_centroid(S, freqs):
+    """
+    Per-frame spectral centroid from a magnitude spectrogram as one weighted column sum
+    """
+    total = S.sum(axis=0)
+    return np.divide(freqs @ S, total, out=np.zeros(S.shape[1]), where=total > 0)
+
+def extract_features(y, sr, frame_length=1024, hop_length=512, n_fft=2048):
+    """
+    Compute per-frame features and the frequency spectrum from a fully loaded signal
+    """
+    # Only the magnitude is used below (spectral centroid)
+    S = np.abs(fast_stft(y, n_fft, hop_length))
+    
+    # Real-input FFT only computes the non-negative frequencies
+    magnitude = np.abs(rfft(y))
+    
+    return {
+        "duration": len(y) / sr,
+        "energy": compute_frame_energy(y, frame_length, hop_length),
+        "rms": librosa.feature.rms(y=y, hop_length=hop_length)[0],
+        "spectral_centroids": spectral_centroid(S, rfftfreq(n_fft, d=1/sr)),
+        "max_amplitude": np.max(np.abs(y)),
+        "frequency": rfftfreq(len(y), d=1/sr),
+        "magnitude": magnitude
+    }
+
+def extract_features_streaming(sound_file, frame_length=1024, hop_length=512, n_fft=2048,
+                               block_seconds=10, welch_nperseg=4096):
+    """
+    Compute the same features as extract_features block by block, so the decoded signal and its STFT are never held in full
+    """
+    sr = sound_file.samplerate
+    half = n_fft // 2
+    # Energy frames are read from the second half of each centered STFT window
+    if frame_length > n_fft - half:
+        raise ValueError("frame_length must fit in the second half of the STFT window")
+    if sound_file.frames == 0:
+        raise ValueError("Audio file contains no samples")
+    window = hann(n_fft, sym=False).astype(np.float32)
+    freqs = rfftfreq(n_fft, d=1/sr)
+    blocksize = max(hop_length, sr * block_seconds // hop_length * hop_length)
+    # Every full block (and a file shorter than one block) is long enough for a Welch segment
+    welch_nperseg = min(welch_nperseg, blocksize, sound_file.frames)
+    
+    energy, rms, centroids = [], [], []
+    
+    def consume(buffer):
+        # Process every complete centered frame in the buffer and return the unused tail
+        if len(buffer) < n_fft:
+            return buffer
+        windows = sliding_window_view(buffer, n_fft)[::hop_length]
+        S = np.abs(rfft(windows * window, axis=-1, workers=audio_common.FFT_WORKERS)).T
+        centroids.append(spectral_centroid(S, freqs))
+        rms.append(np.sqrt(np.mean(np.square(windows, dtype=np.float64), axis=1)))
+        frames = windows[:, half:half + frame_length]
+        energy.append(np.einsum('ij,ij->i', frames, frames, dtype=np.float64))
+        return buffer[len(windows) * hop_length:]
+    
+    # The leading half window is the same zero padding librosa uses for centered frames
+    buffer = np.zeros(half, dtype=np.float32)
+    max_amplitude = 0.0
+    psd_sum = 0.0
+    psd_weight = 0
+    for block in sound_file.blocks(blocksize=blocksize, dtype='float32', always_2d=True):
+        block = block.mean(axis=1)
+        max_amplitude = max(max_amplitude, float(np.max(np.abs(block))))
+        
+        # Welch-averaged PSD replaces the single full-length FFT
+        if len(block) >= welch_nperseg:
+            frequency, psd = welch(block, fs=sr, nperseg=welch_nperseg)
+            psd_sum = psd_sum + psd * len(block)
+            psd_weight += len(block)
+        
+        buffer = consume(np.concatenate((buffer, block)))
+    consume(np.concatenate((buffer, np.zeros(half, dtype=np.float32))))
+    
+    return {
+        "duration": sound_file.frames / sr,
+        "energy": np.concatenate(energy)[:-(-sound_file.frames // hop_length)],
+        "rms": np.concatenate(rms),
+        "spectral_centroids": np.concatenate(centroids),
+        "max_amplitude": max_amplitude,
+        "frequency": frequency,
+        "magnitude": np.sqrt(psd_sum / psd_weight)
+    }
+
+def analyze_audio(audio_data_base64, filename="uploaded_audio", indent=2):
     """
     Analyze audio data and return comprehensive forensic analysis results
     """
@@ -27,43 +127,34 @@ def analyze_audio(audio_data_base64, filename="uploaded_audio"):
         # Decode base64 audio data
         audio_bytes = base64.b64decode(audio_data_base64)
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            temp_file.write(audio_bytes)
-            temp_path = temp_file.name
-        
-        # Load audio with librosa
-        y, sr = librosa.load(temp_path, sr=None)
+        # Stream long files block by block; shorter ones are decoded in full
+        features = None
+        try:
+            sound_file = sf.SoundFile(io.BytesIO(audio_bytes))
+        except RuntimeError:
+            sound_file = None  # Not readable by soundfile; load_audio_bytes falls back to librosa
+        if sound_file is not None:
+            with sound_file:
+                if sound_file.frames >= STREAMING_MIN_DURATION * sound_file.samplerate:
+                    sr = sound_file.samplerate
+                    features = extract_features_streaming(sound_file)
+        if features is None:
+            # Load audio (decoded in memory for WAV/FLAC/OGG)
+            y, sr = load_audio_bytes(audio_bytes, filename)
+            features = extract_features(y, sr)
         
+        duration = features["duration"]
         print(f"✅ Audio loaded: {filename}")
         print(f"Sample Rate: {sr} Hz")
-        print(f"Duration: {librosa.get_duration(y=y, sr=sr):.2f} seconds")
-        
-        # ================================
-        # STFT - Short-Time Fourier Transform
-        # ================================
-        stft_result = librosa.stft(y)
-        stft_db = librosa.amplitude_to_db(np.abs(stft_result), ref=np.max)
-        
-        # ================================
-        # FFT - Fast Fourier Transform
-        # ================================
-        fft_result = np.fft.fft(y)
-        magnitude = np.abs(fft_result)
-        frequency = np.linspace(0, sr, len(magnitude))
+        print(f"Duration: {duration:.2f} seconds")
         
         # ================================
         # Detect Sound Events
         # ================================
-        frame_length = 1024
         hop_length = 512
-        energy = np.array([
-            sum(abs(y[i:i+frame_length]**2))
-            for i in range(0, len(y), hop_length)
-        ])
         
         # Normalize energy
-        energy = energy / np.max(energy) if np.max(energy) > 0 else energy
+        energy = normalize_energy(features["energy"])
         
         # Find peaks (sound events)
         peaks, properties = find_peaks(energy, height=0.2, distance=5)
@@ -72,53 +163,51 @@ def analyze_audio(audio_data_base64, filename="uploaded_audio"):
         # ================================
         # Advanced Analysis
         # ================================
-        duration = librosa.get_duration(y=y, sr=sr)
-        rms = np.mean(librosa.feature.rms(y=y))
+        rms = np.mean(features["rms"])
         
         # Spectral features
-        spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
+        spectral_centroids = features["spectral_centroids"]
         dominant_frequency = np.mean(spectral_centroids)
         
         # Convert to decibels
-        max_decibels = 20 * np.log10(np.max(np.abs(y))) if np.max(np.abs(y)) > 0 else -np.inf
+        max_amplitude = features["max_amplitude"]
+        max_decibels = 20 * np.log10(max_amplitude) if max_amplitude > 0 else -np.inf
         
         # Detect different types of sounds based on frequency characteristics
-        sound_events = []
-        for i, peak in enumerate(peaks):
-            time_pos = (peak * hop_length) / sr
-            freq_at_peak = spectral_centroids[min(peak, len(spectral_centroids)-1)]
-            amplitude = energy[peak]
-            
-            # Classify sound type based on frequency
-            if freq_at_peak < 300:
-                sound_type = "Low Frequency/Bass"
-            elif freq_at_peak < 1000:
-                sound_type = "Voice/Mid Range"
-            elif freq_at_peak < 4000:
-                sound_type = "High Voice/Instruments"
-            else:
-                sound_type = "High Frequency/Noise"
-            
-            sound_events.append({
-                "time": round(time_pos, 2),
-                "frequency": round(freq_at_peak, 1),
-                "amplitude": round(amplitude, 3),
-                "type": sound_type,
-                "decibels": round(20 * np.log10(amplitude) if amplitude > 0 else -np.inf, 1)
-            })
-        
-        # Sort by amplitude (loudest first)
-        sound_events.sort(key=lambda x: x["amplitude"], reverse=True)
+        time_pos = peaks * hop_length / sr
+        freq_at_peak = spectral_centroids[np.minimum(peaks, len(spectral_centroids) - 1)]
+        amplitude = energy[peaks]
+        decibels = 20 * np.log10(np.maximum(amplitude, 1e-12))
+        
+        # Classify sound type based on frequency
+        sound_types = np.select([
+            freq_at_peak < 300,
+            freq_at_peak < 1000,
+            freq_at_peak < 4000
+        ], [
+            "Low Frequency/Bass",
+            "Voice/Mid Range",
+            "High Voice/Instruments"
+        ], default="High Frequency/Noise")
+        
+        events = np.zeros(len(peaks), dtype=[
+            ("time", "f8"), ("frequency", "f8"), ("amplitude", "f8"), ("type", "U24"), ("decibels", "f8")
+        ])
+        # Values are rounded in bulk per column, as they are reported
+        events["time"] = np.round(time_pos, 2)
+        events["frequency"] = np.round(freq_at_peak, 1)
+        events["amplitude"] = np.round(amplitude, 3)
+        events["type"] = sound_types
+        events["decibels"] = np.round(decibels, 1)
+        
+        # Sort by amplitude (loudest first) and only build dicts for the top 10 events
+        top_events = events[np.argsort(-events["amplitude"], kind="stable")[:10]]
+        sound_events = [dict(zip(events.dtype.names, event)) for event in top_events.tolist()]
         
         # Create frequency spectrum data
-        freq_spectrum = []
-        freq_step = len(frequency) // 100  # Sample 100 points
-        for i in range(0, len(frequency)//2, freq_step):
-            if i < len(magnitude):
-                freq_spectrum.append({
-                    "frequency": round(frequency[i], 1),
-                    "magnitude": round(magnitude[i] / np.max(magnitude), 3) if np.max(magnitude) > 0 else 0
-                })
+        magnitude = features["magnitude"]
+        frequency = features["frequency"]
+        freq_spectrum = sample_spectrum(frequency, magnitude, sr, 100)  # Sample 100 points
         
         # ================================
         # Generate Analysis Report
@@ -130,8 +219,9 @@ def analyze_audio(audio_data_base64, filename="uploaded_audio"):
             "averageRMS": round(float(rms), 6),
             "detectedSounds": num_sounds,
             "dominantFrequency": round(float(dominant_frequency), 1),
-            "maxDecibels": round(float(max_decibels), 1),
-            "soundEvents": sound_events[:10],  # Top 10 events
+            # Silent input has no finite peak level; report null rather than -Infinity
+            "maxDecibels": round(float(max_decibels), 1) if np.isfinite(max_decibels) else None,
+            "soundEvents": sound_events,  # Top 10 events
             "frequencySpectrum": freq_spectrum,
             "analysisComplete": True,
             "timestamp": "2024-01-01T00:00:00Z"
@@ -150,10 +240,7 @@ def analyze_audio(audio_data_base64, filename="uploaded_audio"):
         for i, event in enumerate(sound_events[:5]):
             print(f"{i+1}. {event['type']} at {event['time']}s - {event['frequency']:.1f}Hz ({event['decibels']:.1f}dB)")
         
-        # Clean up temporary file
-        os.unlink(temp_path)
-        
-        return json.dumps(analysis_results, indent=2)
+        return to_json(analysis_results, indent=indent)
         
     except Exception as e:
         error_result = {
@@ -162,15 +249,30 @@ def analyze_audio(audio_data_base64, filename="uploaded_audio"):
             "message": "Audio analysis failed"
         }
         print(f"❌ Analysis Error: {str(e)}")
-        return json.dumps(error_result, indent=2)
+        return to_json(error_result, indent=indent)
+
+def prewarm(sr=22050):
+    """
+    Trigger librosa's lazy imports and build FFT plans for the STFT frame size before the first request
+    """
+    extract_features(np.zeros(sr, dtype=np.float32), sr)
 
 if __name__ == "__main__":
+    # Long-running worker mode keeps stdout for JSON results only
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve(analyze_audio, prewarm, "uploaded_audio")
+        sys.exit(0)
+    
     # Example usage - in real implementation, this would receive base64 data
     print("🎵 Audio Forensic Analysis System Ready")
     print("Waiting for audio data...")
     
-    # This script can be called with audio data as argument
-    if len(sys.argv) > 1:
+    # This script can be called with audio data as argument, --batch and a glob of files,
+    # or --serve to run as a long-lived worker reading JSON requests from stdin
+    if len(sys.argv) > 2 and sys.argv[1] == "--batch":
+        for result in batch_analyze(analyze_audio, sorted(glob.glob(sys.argv[2]))):
+            print(result)
+    elif len(sys.argv) > 1:
         audio_data = sys.argv[1]
         filename = sys.argv[2] if len(sys.argv) > 2 else "uploaded_audio"
         result = analyze_audio(audio_data, filename)
@@ -0,0 +1,153 @@
+# ================================
+# Shared Audio Analysis Helpers
+# Used by audio_analysis.py and live_audio_analysis.py
+# ================================
+
+import librosa
+import numpy as np
+import soundfile as sf
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.fft import rfft
+from scipy.signal.windows import hann
+import json
+import sys
+import base64
+import io
+import tempfile
+import os
+import contextlib
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # Optional: only used to pin BLAS threads in batch workers
+    threadpool_limits = None
+
+try:
+    import orjson
+except ImportError:  # Optional: faster JSON output with native NumPy array support
+    orjson = None
+
+# Threads per scipy FFT call; batch workers drop this to 1 since the pool already uses every core
+FFT_WORKERS = -1
+
+def to_json(obj, indent=2):
+    """
+    Serialize results with orjson when available (NumPy arrays natively), otherwise the json module
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option).decode()
+    # allow_nan=False: never emit NaN/Infinity, which are not valid JSON
+    return json.dumps(obj, indent=indent, allow_nan=False, default=lambda value: value.tolist())
+
+def compute_frame_energy(y, frame_length=1024, hop_length=512):
+    """
+    Compute the energy of every hop-spaced frame in a single vectorized pass
+    """
+    # Zero-pad the tail so trailing partial frames are kept, matching the
+    # original per-frame slicing
+    frames = sliding_window_view(np.pad(y, (0, frame_length)), frame_length)[:len(y):hop_length]
+    # Dot each frame with itself; no squared copy of the signal is materialized
+    return np.einsum('ij,ij->i', frames, frames, dtype=np.float64)
+
+def normalize_energy(energy):
+    """
+    Scale energy to a peak of 1.0 using a single max scan
+    """
+    peak = energy.max() if len(energy) > 0 else 0.0
+    return energy / peak if peak > 0 else energy
+
+def sample_spectrum(frequency, magnitude, sr, n_points):
+    """
+    Resample a magnitude spectrum onto a log-spaced 20 Hz - Nyquist grid, relative to its peak
+    """
+    target_freqs = np.logspace(np.log10(20), np.log10(sr / 2), n_points)
+    mag_max = magnitude.max()
+    inv_mag_max = 1.0 / mag_max if mag_max > 0 else 0.0
+    sampled_mag = np.interp(target_freqs, frequency, magnitude) * inv_mag_max
+    return [
+        {"frequency": f, "magnitude": m}
+        for f, m in zip(np.round(target_freqs, 1).tolist(), np.round(sampled_mag, 3).tolist())
+    ]
+
+def fast_stft(y, n_fft=2048, hop_length=512):
+    """
+    Centered Hann-window STFT laid out like librosa.stft, using scipy's multi-threaded FFT
+    """
+    y_padded = np.pad(y, n_fft // 2)
+    window = hann(n_fft, sym=False).astype(np.float32)
+    frames = sliding_window_view(y_padded, n_fft)[::hop_length] * window
+    return rfft(frames, axis=-1, workers=FFT_WORKERS).T
+
+def load_audio_bytes(audio_bytes, filename=""):
+    """
+    Decode audio bytes in memory, falling back to a temporary file for formats soundfile cannot read
+    """
+    try:
+        y, sr = sf.read(io.BytesIO(audio_bytes), dtype='float32', always_2d=False)
+        if y.ndim > 1:
+            y = y.mean(axis=1)
+    except RuntimeError:
+        # Keep the upload's extension on the temporary file so librosa's decoder fallback can identify the format
+        suffix = os.path.splitext(filename)[1] or '.wav'
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+            temp_file.write(audio_bytes)
+            temp_path = temp_file.name
+        try:
+            y, sr = librosa.load(temp_path, sr=None)
+        finally:
+            os.unlink(temp_path)
+    
+    # Keep the whole pipeline in float32 to halve memory traffic in the STFT/FFT
+    return np.ascontiguousarray(y, dtype=np.float32), sr
+
+def init_batch_worker():
+    """
+    Limit each batch worker process to one BLAS/OpenMP/FFT thread to avoid oversubscription
+    """
+    global FFT_WORKERS
+    FFT_WORKERS = 1
+    if threadpool_limits is not None:
+        threadpool_limits(1)
+
+def analyze_file(analyze, path):
+    """
+    Run an analysis function (base64 audio, filename) on an audio file from disk
+    """
+    with open(path, 'rb') as audio_file:
+        audio_data = base64.b64encode(audio_file.read())
+    return analyze(audio_data, os.path.basename(path))
+
+def batch_analyze(analyze, files, n_workers=None):
+    """
+    Analyze many audio files in parallel worker processes, returning results in input order
+    """
+    n_workers = n_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_batch_worker) as executor:
+        return list(executor.map(functools.partial(analyze_file, analyze), files))
+
+def serve(analyze, prewarm, default_filename):
+    """
+    Answer requests read from stdin, one JSON object per line ({"audio": <base64>, "filename": ...}),
+    with one JSON result per line on stdout, keeping imports and FFT plans warm between files
+    """
+    prewarm()
+    print("🎧 Analysis worker ready", file=sys.stderr, flush=True)
+    
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            audio_data = request["audio"]
+            filename = request.get("filename", default_filename)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            result = to_json({"error": str(e), "analysisComplete": False, "message": "Invalid request"}, indent=None)
+        else:
+            # Progress messages go to stderr so stdout only carries results
+            with contextlib.redirect_stdout(sys.stderr):
+                result = analyze(audio_data, filename, indent=None)
+        sys.stdout.write(result + "\n")
+        sys.stdout.flush()
@@ -8,6 +8,7 @@ import librosa.display
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
+from scipy.fft import rfft, rfftfreq
 from scipy.signal import find_peaks
 import json
 import sys
@@ -16,14 +17,145 @@ import io
 from scipy.io import wavfile
 import tempfile
 import os
+import glob
 import plotly.graph_objs as go
 import plotly.offline as opy
 from datetime import datetime
+from audio_common import (
+    to_json, compute_frame_energy, normalize_energy, sample_spectrum, fast_stft,
+    load_audio_bytes, batch_analyze, serve
+)
+
+# Optional: GPU spectral features for long files (imported on first use, see _load_torch)
+torch = None
+torchaudio = None
+
+# Shorter clips finish faster on CPU than with a CUDA round-trip
+GPU_MIN_DURATION = 60  # seconds
 
 # Set matplotlib to use Agg backend for server environments
 matplotlib.use('Agg')
 
-def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
+def downsample_axis(values, target, axis=-1):
+    """
+    Average consecutive blocks so values has at most target entries along axis
+    """
+    n = values.shape[axis]
+    step = -(-n // target)
+    if step <= 1:
+        return values
+    starts = np.arange(0, n, step)
+    counts = np.diff(np.append(starts, n))
+    shape = [1] * values.ndim
+    shape[axis] = -1
+    return np.add.reduceat(values, starts, axis=axis) / counts.reshape(shape)
+
+def encode_heatmap(db, x, y, max_size=512, db_range=(-80.0, 0.0)):
+    """
+    Downsample a dB heatmap and pack it as base64-encoded uint8 for compact JSON export
+    """
+    z = downsample_axis(downsample_axis(db, max_size, axis=0), max_size, axis=1)
+    
+    # Quantize the dB range onto 0-255; rows are frequency bins, columns are time frames
+    low, high = db_range
+    z_u8 = np.round((np.clip(z, low, high) - low) * (255 / (high - low))).astype(np.uint8)
+    
+    return {
+        "z": base64.b64encode(np.ascontiguousarray(z_u8).tobytes()).decode("ascii"),
+        "zEncoding": "uint8-base64",
+        "zShape": list(z_u8.shape),
+        "zRange": [low, high],
+        "x": downsample_axis(x, max_size),
+        "y": downsample_axis(y, max_size)
+    }
+
+def spectral_shape(S, freqs, roll_percent=0.85):
+    """
+    Per-frame spectral centroid and rolloff from a magnitude spectrogram, sharing one cumulative-sum pass
+    """
+    cumulative = np.cumsum(S, axis=0)
+    total = cumulative[-1]
+    centroid = np.divide(freqs @ S, total, out=np.zeros(S.shape[1]), where=total > 0)
+    rolloff = freqs[np.argmax(cumulative >= roll_percent * total, axis=0)]
+    return centroid, rolloff
+
+def compute_spectral_features(y, sr, n_fft=2048, hop_length=512):
+    """
+    Compute the STFT heatmap, centroid, rolloff and MFCCs on the CPU
+    """
+    stft_result = fast_stft(y, n_fft, hop_length)
+    # Power is computed once; magnitude is derived from it only for centroid/rolloff
+    P = stft_result.real**2 + stft_result.imag**2
+    S = np.sqrt(P)
+    mel_spectrogram = librosa.feature.melspectrogram(S=P, sr=sr)
+    spectral_centroids, spectral_rolloff = spectral_shape(S, rfftfreq(n_fft, d=1/sr))
+    
+    return {
+        "stft_db": librosa.power_to_db(P, ref=np.max, amin=1e-10),
+        "spectral_centroids": spectral_centroids,
+        "spectral_rolloff": spectral_rolloff,
+        "mfccs": librosa.feature.mfcc(S=librosa.power_to_db(mel_spectrogram), n_mfcc=13)
+    }
+
+def _load_torch():
+    """
+    Import torch and torchaudio the first time a file qualifies for the GPU path
+    """
+    global torch, torchaudio
+    if torch is None:
+        try:
+            import torch as torch_module
+            import torchaudio as torchaudio_module
+        except ImportError:
+            return False
+        torch, torchaudio = torch_module, torchaudio_module
+    return True
+
+def compute_spectral_features_gpu(y, sr, device="cuda", n_fft=2048, hop_length=512, max_size=512):
+    """
+    Compute the same features as compute_spectral_features on the GPU with torchaudio
+    """
+    waveform = torch.from_numpy(np.ascontiguousarray(y, dtype=np.float32)).to(device)
+    spectrogram = torchaudio.transforms.Spectrogram(
+        n_fft=n_fft, hop_length=hop_length, power=2.0, pad_mode="constant"
+    ).to(device)
+    
+    with torch.no_grad():
+        P = spectrogram(waveform)
+        S = torch.sqrt(P)
+        n_bins = S.shape[0]
+        freqs = torch.linspace(0, sr / 2, n_bins, device=device)
+        
+        # Centroid and 85% rolloff, as in librosa
+        total = S.sum(dim=0)
+        centroids = torch.where(total > 0, (freqs[:, None] * S).sum(dim=0) / total, torch.zeros_like(total))
+        reached = torch.cumsum(S, dim=0) >= 0.85 * total
+        rolloff = freqs[reached.int().argmax(dim=0)]
+        
+        # Slaney mel filterbank + orthonormal DCT, matching librosa.feature.mfcc defaults
+        mel_fb = torchaudio.functional.melscale_fbanks(
+            n_bins, 0.0, sr / 2, 128, sr, norm="slaney", mel_scale="slaney"
+        ).to(device)
+        mel_db = torchaudio.functional.amplitude_to_DB(
+            mel_fb.T @ P, multiplier=10.0, amin=1e-10, db_multiplier=0.0, top_db=80.0
+        )
+        dct = torchaudio.functional.create_dct(13, 128, norm="ortho").to(device)
+        mfccs = dct.T @ mel_db
+        
+        # Downsample the dB heatmap on the device so only the small version is copied back
+        stft_db = 10 * torch.log10(torch.clamp(P, min=1e-10))
+        stft_db = torch.clamp(stft_db - stft_db.max(), min=-80.0)
+        steps = (-(-stft_db.shape[0] // max_size), -(-stft_db.shape[1] // max_size))
+        stft_db = torch.nn.functional.avg_pool2d(stft_db[None], steps, ceil_mode=True)[0]
+    
+    return {
+        "stft_db": stft_db.cpu().numpy(),
+        "spectral_centroids": centroids.cpu().numpy(),
+        "spectral_rolloff": rolloff.cpu().numpy(),
+        "mfccs": mfccs.cpu().numpy()
+    }
+
+def generate_live_analysis(audio_data_base64, filename="uploaded_audio", device="cuda", indent=2):
     """
     Generate comprehensive live audio analysis with multiple visualizations
     """
@@ -31,13 +163,8 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
         # Decode base64 audio data
         audio_bytes = base64.b64decode(audio_data_base64)
         
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-            temp_file.write(audio_bytes)
-            temp_path = temp_file.name
-        
-        # Load audio with librosa
-        y, sr = librosa.load(temp_path, sr=None)
+        # Load audio (decoded in memory for WAV/FLAC/OGG)
+        y, sr = load_audio_bytes(audio_bytes, filename)
         
         print(f"🎵 Live Analysis Started: {filename}")
         print(f"Sample Rate: {sr} Hz")
@@ -46,18 +173,26 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
         # ================================
         # STFT - Short-Time Fourier Transform
         # ================================
-        stft_result = librosa.stft(y, hop_length=512, n_fft=2048)
-        stft_db = librosa.amplitude_to_db(np.abs(stft_result), ref=np.max)
+        # Long files go through torchaudio when a CUDA device is available
+        use_gpu = (
+            device is not None and device.startswith("cuda") and len(y) >= GPU_MIN_DURATION * sr
+            and _load_torch() and torch.cuda.is_available()
+        )
+        if use_gpu:
+            features = compute_spectral_features_gpu(y, sr, device)
+        else:
+            features = compute_spectral_features(y, sr)
+        stft_db = features["stft_db"]
+        spectral_centroids = features["spectral_centroids"]
         
         # Time and frequency axes
-        time_frames = librosa.frames_to_time(np.arange(stft_db.shape[1]), sr=sr, hop_length=512)
+        time_frames = librosa.frames_to_time(np.arange(len(spectral_centroids)), sr=sr, hop_length=512)
         freq_bins = librosa.fft_frequencies(sr=sr, n_fft=2048)
         
-        # Create STFT heatmap data
+        # Create STFT heatmap data (downsampled and quantized, see encode_heatmap)
+        heatmap = encode_heatmap(stft_db, time_frames, freq_bins)
         stft_data = {
-            "z": stft_db.tolist(),
-            "x": time_frames.tolist(),
-            "y": freq_bins.tolist(),
+            **heatmap,
             "type": "heatmap",
             "colorscale": "Viridis",
             "title": "STFT - Short-Time Fourier Transform"
@@ -66,12 +201,9 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
         # ================================
         # Live Spectrogram
         # ================================
-        # Enhanced spectrogram with better resolution
-        D = librosa.amplitude_to_db(np.abs(stft_result), ref=np.max)
+        # Same dB matrix as the STFT view, so the encoded heatmap is shared
         spectrogram_data = {
-            "z": D.tolist(),
-            "x": time_frames.tolist(),
-            "y": freq_bins.tolist(),
+            **heatmap,
             "type": "heatmap",
             "colorscale": "Magma",
             "title": "Live Spectrogram"
@@ -80,15 +212,14 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
         # ================================
         # FFT - Fast Fourier Transform
         # ================================
-        fft_result = np.fft.fft(y)
+        # Real-input FFT only computes the non-negative frequencies
+        fft_result = rfft(y)
         magnitude = np.abs(fft_result)
-        frequency = np.linspace(0, sr, len(magnitude))
+        frequency = rfftfreq(len(y), d=1/sr)
         
-        # Take only positive frequencies
-        half_length = len(frequency) // 2
         fft_data = {
-            "x": frequency[:half_length].tolist(),
-            "y": magnitude[:half_length].tolist(),
+            "x": frequency,
+            "y": magnitude,
             "type": "scatter",
             "mode": "lines",
             "title": "FFT - Frequency Spectrum"
@@ -101,87 +232,80 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
         hop_length = 512
         
         # Compute energy
-        energy = np.array([
-            sum(abs(y[i:i+frame_length]**2))
-            for i in range(0, len(y), hop_length)
-        ])
+        energy = compute_frame_energy(y, frame_length, hop_length)
         
         # Normalize energy
-        if np.max(energy) > 0:
-            energy = energy / np.max(energy)
+        energy = normalize_energy(energy)
         
         # Find peaks (sound events)
         peaks, properties = find_peaks(energy, height=0.2, distance=5)
         
         # Create energy detection data
         energy_data = {
-            "energy": energy.tolist(),
-            "peaks": peaks.tolist(),
-            "peak_values": energy[peaks].tolist() if len(peaks) > 0 else [],
-            "frames": list(range(len(energy)))
+            "energy": energy,
+            "peaks": peaks,
+            "peak_values": energy[peaks],
+            "frames": np.arange(len(energy))
         }
         
         # ================================
         # Advanced Spectral Features
         # ================================
-        # Spectral centroid (brightness)
-        spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)[0]
-        
-        # Spectral rolloff
-        spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)[0]
+        # Spectral centroid (brightness) and rolloff come from the STFT features above
+        spectral_rolloff = features["spectral_rolloff"]
         
         # Zero crossing rate
         zcr = librosa.feature.zero_crossing_rate(y)[0]
         
         # MFCC features
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+        mfccs = features["mfccs"]
         
         # ================================
         # Sound Classification
         # ================================
-        sound_events = []
-        for i, peak in enumerate(peaks):
-            time_pos = (peak * hop_length) / sr
-            
-            # Get spectral features at this time
-            frame_idx = min(peak, len(spectral_centroids) - 1)
-            centroid = spectral_centroids[frame_idx]
-            rolloff = spectral_rolloff[frame_idx]
-            zcr_val = zcr[frame_idx] if frame_idx < len(zcr) else 0
-            
-            # Classify based on spectral features
-            if centroid < 1000 and rolloff < 2000:
-                sound_type = "Low Frequency/Bass"
-                confidence = 0.8
-            elif centroid < 3000 and zcr_val < 0.1:
-                sound_type = "Voice/Speech"
-                confidence = 0.9
-            elif centroid > 4000 and rolloff > 8000:
-                sound_type = "High Frequency/Noise"
-                confidence = 0.7
-            elif zcr_val > 0.15:
-                sound_type = "Percussive/Transient"
-                confidence = 0.85
-            else:
-                sound_type = "Mixed/Complex"
-                confidence = 0.6
-            
-            amplitude = energy[peak]
-            decibels = 20 * np.log10(amplitude) if amplitude > 0 else -np.inf
-            
-            sound_events.append({
-                "time": round(time_pos, 2),
-                "frequency": round(float(centroid), 1),
-                "amplitude": round(float(amplitude), 3),
-                "type": sound_type,
-                "confidence": confidence,
-                "decibels": round(float(decibels), 1),
-                "spectral_rolloff": round(float(rolloff), 1),
-                "zero_crossing_rate": round(float(zcr_val), 3)
-            })
-        
-        # Sort by amplitude (loudest first)
-        sound_events.sort(key=lambda x: x["amplitude"], reverse=True)
+        time_pos = peaks * hop_length / sr
+        
+        # Get spectral features at each peak
+        frame_idx = np.minimum(peaks, len(spectral_centroids) - 1)
+        centroid = spectral_centroids[frame_idx]
+        rolloff = spectral_rolloff[frame_idx]
+        zcr_val = np.where(frame_idx < len(zcr), zcr[np.minimum(frame_idx, len(zcr) - 1)], 0)
+        
+        # Classify based on spectral features (first matching rule wins)
+        rules = [
+            (centroid < 1000) & (rolloff < 2000),
+            (centroid < 3000) & (zcr_val < 0.1),
+            (centroid > 4000) & (rolloff > 8000),
+            zcr_val > 0.15
+        ]
+        sound_types = np.select(rules, [
+            "Low Frequency/Bass",
+            "Voice/Speech",
+            "High Frequency/Noise",
+            "Percussive/Transient"
+        ], default="Mixed/Complex")
+        confidences = np.select(rules, [0.8, 0.9, 0.7, 0.85], default=0.6)
+        
+        amplitude = energy[peaks]
+        decibels = 20 * np.log10(np.maximum(amplitude, 1e-12))
+        
+        events = np.zeros(len(peaks), dtype=[
+            ("time", "f8"), ("frequency", "f8"), ("amplitude", "f8"), ("type", "U24"), ("confidence", "f8"),
+            ("decibels", "f8"), ("spectral_rolloff", "f8"), ("zero_crossing_rate", "f8")
+        ])
+        # Values are rounded in bulk per column, as they are reported
+        events["time"] = np.round(time_pos, 2)
+        events["frequency"] = np.round(centroid, 1)
+        events["amplitude"] = np.round(amplitude, 3)
+        events["type"] = sound_types
+        events["confidence"] = confidences
+        events["decibels"] = np.round(decibels, 1)
+        events["spectral_rolloff"] = np.round(rolloff, 1)
+        events["zero_crossing_rate"] = np.round(zcr_val, 3)
+        
+        # Sort by amplitude (loudest first) and only build dicts for the top 15 events
+        top_events = events[np.argsort(-events["amplitude"], kind="stable")[:15]]
+        sound_events = [dict(zip(events.dtype.names, event)) for event in top_events.tolist()]
         
         # ================================
         # Generate Comprehensive Report
@@ -197,14 +321,7 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
         max_decibels = 20 * np.log10(max_amplitude) if max_amplitude > 0 else -np.inf
         
         # Frequency spectrum for visualization
-        freq_spectrum = []
-        freq_step = len(frequency) // 200  # Sample 200 points
-        for i in range(0, len(frequency)//2, max(1, freq_step)):
-            if i < len(magnitude):
-                freq_spectrum.append({
-                    "frequency": round(frequency[i], 1),
-                    "magnitude": round(magnitude[i] / np.max(magnitude), 3) if np.max(magnitude) > 0 else 0
-                })
+        freq_spectrum = sample_spectrum(frequency, magnitude, sr, 200)  # Sample 200 points
         
         # ================================
         # Live Analysis Results
@@ -217,8 +334,9 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
             "averageRMS": round(float(rms), 6),
             "detectedSounds": len(peaks),
             "dominantFrequency": round(float(dominant_freq), 1),
-            "maxDecibels": round(float(max_decibels), 1),
-            "soundEvents": sound_events[:15],  # Top 15 events
+            # Silent input has no finite peak level; report null rather than -Infinity
+            "maxDecibels": round(float(max_decibels), 1) if np.isfinite(max_decibels) else None,
+            "soundEvents": sound_events,  # Top 15 events
             "frequencySpectrum": freq_spectrum,
             
             # Visualization data
@@ -234,7 +352,7 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
                 "meanSpectralCentroid": round(float(np.mean(spectral_centroids)), 1),
                 "meanSpectralRolloff": round(float(np.mean(spectral_rolloff)), 1),
                 "meanZeroCrossingRate": round(float(np.mean(zcr)), 3),
-                "mfccMean": [round(float(np.mean(mfcc)), 3) for mfcc in mfccs]
+                "mfccMean": np.round(np.mean(mfccs, axis=1, dtype=np.float64), 3).tolist()
             },
             
             "analysisComplete": True,
@@ -254,10 +372,7 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
         for i, event in enumerate(sound_events[:5]):
             print(f"{i+1}. {event['type']} at {event['time']}s - {event['frequency']:.1f}Hz ({event['decibels']:.1f}dB) - Confidence: {event['confidence']:.1%}")
         
-        # Clean up temporary file
-        os.unlink(temp_path)
-        
-        return json.dumps(live_analysis_results, indent=2)
+        return to_json(live_analysis_results, indent=indent)
         
     except Exception as e:
         error_result = {
@@ -268,7 +383,45 @@ def generate_live_analysis(audio_data_base64, filename="uploaded_audio"):
             "timestamp": datetime.now().isoformat()
         }
         print(f"❌ Live Analysis Error: {str(e)}")
-        return json.dumps(error_result, indent=2)
+        return to_json(error_result, indent=indent)
+
+def _centroid_energy_loop(audio_chunk, magnitude, freqs):
+    """
+    Spectral centroid and signal energy of one chunk in a single fused loop (compiled with numba)
+    """
+    weighted = 0.0
+    total = 0.0
+    for i in range(magnitude.shape[0]):
+        weighted += freqs[i] * magnitude[i]
+        total += magnitude[i]
+    energy = 0.0
+    for i in range(audio_chunk.shape[0]):
+        energy += audio_chunk[i] * audio_chunk[i]
+    return (weighted / total if total > 0 else 0.0), energy
+
+def _centroid_energy_numpy(audio_chunk, magnitude, freqs):
+    """
+    Spectral centroid and signal energy of one chunk (NumPy fallback without numba)
+    """
+    total = np.sum(magnitude)
+    centroid = np.dot(freqs, magnitude) / total if total > 0 else 0.0
+    return centroid, np.dot(audio_chunk, audio_chunk)
+
+# Chosen on the first real-time chunk, so importing numba is not paid at module import
+centroid_energy = None
+
+def _load_centroid_energy():
+    """
+    Pick the numba-compiled centroid/energy kernel when numba is installed, else the NumPy fallback
+    """
+    global centroid_energy
+    try:
+        from numba import njit
+    except ImportError:  # Optional: JIT for the real-time chunk path
+        centroid_energy = _centroid_energy_numpy
+    else:
+        centroid_energy = njit(cache=True, fastmath=True)(_centroid_energy_loop)
+    return centroid_energy
 
 def process_real_time_chunk(audio_chunk, sr=44100):
     """
@@ -276,18 +429,16 @@ def process_real_time_chunk(audio_chunk, sr=44100):
     """
     try:
         # Quick FFT analysis
-        fft_result = np.fft.fft(audio_chunk)
+        fft_result = rfft(audio_chunk)
         magnitude = np.abs(fft_result)
         
-        # Energy calculation
-        energy = np.sum(audio_chunk ** 2)
-        
-        # Spectral centroid
-        freqs = np.fft.fftfreq(len(audio_chunk), 1/sr)
-        spectral_centroid = np.sum(freqs[:len(freqs)//2] * magnitude[:len(magnitude)//2]) / np.sum(magnitude[:len(magnitude)//2])
+        # Energy and spectral centroid
+        freqs = rfftfreq(len(audio_chunk), d=1/sr)
+        kernel = centroid_energy or _load_centroid_energy()
+        spectral_centroid, energy = kernel(audio_chunk, magnitude, freqs)
         
         return {
-            "fft": magnitude[:len(magnitude)//2].tolist(),
+            "fft": magnitude.tolist(),
             "energy": float(energy),
             "spectral_centroid": float(spectral_centroid),
             "timestamp": datetime.now().isoformat()
@@ -295,12 +446,30 @@ def process_real_time_chunk(audio_chunk, sr=44100):
     except Exception as e:
         return {"error": str(e)}
 
+def prewarm(sr=22050):
+    """
+    Trigger librosa's lazy imports, FFT plans and the numba JIT before the first request
+    """
+    silence = np.zeros(sr, dtype=np.float32)
+    compute_spectral_features(silence, sr)
+    librosa.feature.zero_crossing_rate(silence)
+    process_real_time_chunk(silence[:2048], sr)
+
 if __name__ == "__main__":
+    # Long-running worker mode keeps stdout for JSON results only
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve(generate_live_analysis, prewarm, "live_audio")
+        sys.exit(0)
+    
     print("🎵 Live Audio Analysis System Ready")
     print("Enhanced with real-time visualization capabilities")
     
-    # This script can be called with audio data as argument
-    if len(sys.argv) > 1:
+    # This script can be called with audio data as argument, --batch and a glob of files,
+    # or --serve to run as a long-lived worker reading JSON requests from stdin
+    if len(sys.argv) > 2 and sys.argv[1] == "--batch":
+        for result in batch_analyze(generate_live_analysis, sorted(glob.glob(sys.argv[2]))):
+            print(result)
+    elif len(sys.argv) > 1:
         audio_data = sys.argv[1]
         filename = sys.argv[2] if len(sys.argv) > 2 else "live_audio"
         result = generate_live_analysis(audio_data, filename)